@@ -1,7 +1,8 @@
 import argparse
 import logging, traceback
 import logging.handlers # For RotatingFileHandler
-import os, sys, datetime, time, glob, tempfile, re
+import os, sys, datetime, time, tempfile, re
+import concurrent.futures, contextlib, queue
 from pathlib import Path
 import tableauhyperapi as THA
 
@@ -41,21 +42,44 @@ if args.log_to_file:
 if args.debug:
     logger.setLevel(logging.DEBUG)
 
+# Errors are logged and we carry on with what we can, but we do let the caller know something went wrong
+exit_code = 0
+
 # Let's go
 logger.info("Biztory tableau_hyper_union.py v0.2")
 logger.info("Author: Timothy Vermeiren")
 logger.info(f"Script launched using (quotes removed): { sys.executable } { sys.argv[0] } { ' '.join([a for i, a in enumerate(sys.argv[1:])]) }")
 
+def normalize_path(path):
+    """Returns a form of the path that can be compared to other paths, regardless of how it was written ("./union.hyper" vs "union.hyper", or case on Windows)."""
+    return os.path.normcase(os.path.abspath(path))
+
 if not args.preserve_output_file:
-    worklist = [hyper_file for hyper_file in glob.glob("*.hyper") if hyper_file != args.output_file]
     output_file = args.output_file
 else:
-    output_file = args.output_file.split(".")[-1] + "_temp.hyper"
-    worklist = [hyper_file for hyper_file in glob.glob("*.hyper") if hyper_file != output_file]
     # We need a temporary output file if we're going to include it in the source itself
+    output_file = os.path.splitext(args.output_file)[0] + "_temp.hyper"
+# Whatever we're writing to can't be an input. In a single pass over the directory, as opposed to listing it and filtering afterwards. Hidden files (such as macOS' "._" resource forks) are skipped, like glob("*.hyper") does.
+excluded_files = { normalize_path(output_file) }
+worklist = [entry.name for entry in os.scandir(".") if os.path.normcase(entry.name).endswith(".hyper") and not entry.name.startswith(".") and entry.is_file() and normalize_path(entry.name) not in excluded_files]
+if args.preserve_output_file and os.path.exists(args.output_file) and normalize_path(args.output_file) not in { normalize_path(hyper_file) for hyper_file in worklist }:
+    # Its contents are part of the output, so we read it like the other files, even if it's not in this directory or doesn't end in .hyper
+    worklist.append(args.output_file)
 logger.info(f"Assimilated { len(worklist) } Hyper files to be processed.")
+# The name each file is attached under. Derived from its position rather than its name, so "sales.hyper" and "sales.v2.hyper" can't end up with the same one.
+file_aliases = { hyper_file: f"src_{ index }" for index, hyper_file in enumerate(worklist) }
 
 output_dict = {} # "Structure" is a dict of dicts of dicts going schema > table > column. Used mostly for comparing.
+file_tables = {} # The (schema, table) pairs each input file has, so we know which files to read a table from without asking the catalog
+input_columns_dict = {} # The columns each input file has, per (file, schema, table), as a dict of column name > column. Saves us from asking the catalog again when writing.
+unreadable_files = [] # Files we couldn't pre-process; these are left out of the UNION altogether
+# The column with the name of the file each row came from: as a Name, to compare to column names as is (Names are equal exactly when their escaped forms are), and escaped, for the SQL. Both are None when we're not adding the column; THA.Name() and THA.escape_name() don't accept empty names.
+if len(args.source_file_column_name) > 0:
+    source_column_name = THA.Name(args.source_file_column_name)
+    escaped_source_column = THA.escape_name(args.source_file_column_name)
+else:
+    source_column_name = None
+    escaped_source_column = None
 
 if args.log_to_file:
     hyper_process_parameters = { "log_dir": str(logs_directory) }
@@ -64,133 +88,314 @@ else:
     temp_log_dir = tempfile.gettempdir()
     hyper_process_parameters = { "log_dir": str(temp_log_dir) }
 
+# The pre-processing of the files is spread over this many threads, sharing as many connections to the Hyper process
+preprocessing_workers = os.cpu_count() or 1
+
+def enumerate_all(connection, database):
+    """Walks all schemas and tables of an attached database in one go, returning their definitions as a dict of dicts going schema > table > TableDefinition. The database alias is left out of the names we hand back, the rest of the script doesn't know about it."""
+    database_dict = {}
+    for schema in connection.catalog.get_schema_names(database=database):
+        schema_name = THA.SchemaName(schema.name)
+        database_dict[schema_name] = {}
+        for table in connection.catalog.get_table_names(schema=schema):
+            database_dict[schema_name][THA.TableName(schema.name, table.name)] = connection.catalog.get_table_definition(name=table)
+    return database_dict
+
+def scan_file(scan_connections, hyper_file):
+    """Returns the table definitions in a Hyper file, see enumerate_all(). Borrows a connection from the pool, attaches the file to it for the duration of the scan and hands the connection back afterwards."""
+    connection = scan_connections.get()
+    try:
+        connection.catalog.attach_database(database_path=hyper_file, alias="scan_input")
+        try:
+            return enumerate_all(connection, "scan_input")
+        finally:
+            connection.catalog.detach_database(alias="scan_input")
+    finally:
+        scan_connections.put(connection)
+
+def accepts_rows(target_columns, input_columns, skip_column_name):
+    """Whether the rows of a table with input_columns can be inserted as is into a table with target_columns (both dicts of column name > column), leaving out skip_column_name. Every column the input has must have the same type and collation, and a NOT NULL column can't be filled from an input that lacks it or allows NULLs in it."""
+    for column_name, target_column in target_columns.items():
+        if column_name == skip_column_name:
+            continue
+        input_column = input_columns.get(column_name)
+        if input_column is None:
+            # We'd fill it with NULLs
+            if target_column.nullability == THA.Nullability.NOT_NULLABLE:
+                return False
+        elif input_column.type != target_column.type or input_column.collation != target_column.collation:
+            return False
+        elif target_column.nullability == THA.Nullability.NOT_NULLABLE and input_column.nullability != THA.Nullability.NOT_NULLABLE:
+            return False
+    return True
+
+# What goes between the SELECTs of a UNION query. The SELECTs are collected in a list and joined with this once, rather than building the query up piece by piece and trimming what's left over at the end.
+union_separator = "\nUNION ALL\n"
+
 with THA.HyperProcess(telemetry=THA.Telemetry.SEND_USAGE_DATA_TO_TABLEAU, parameters=hyper_process_parameters) as hyper:
 
     # Pre-process the files, so we know which schemas and tables we need to go through. We also need to know about columns, because UNION might complain otherwise
 
-    for hyper_file in worklist:
-        try:
-            with THA.Connection(endpoint=hyper.endpoint, database=hyper_file) as connection:
-                logger.info(f"Assimilating database/file { hyper_file }:")
-
-                # Schemas are the top level
-                for schema in connection.catalog.get_schema_names():
-                    logger.info(f"\t- Schema { schema }:")
-                    if schema not in output_dict:
-                        # SchemaDefinition as key, because why not
-                        output_dict[schema] = {}
-
-                    # Then tables
-                    for table in connection.catalog.get_table_names(schema=schema):
-                        logger.info(f"\t\t- Table { table }")
-                        if table not in output_dict[schema]:
-                            # TableDefinition as key, because why not. We'll make this a list though because its contents, column, is at the lowest level
-                            output_dict[schema][table] = []
-                        table_definition = connection.catalog.get_table_definition(name=table)
-                        logger.info(f"\t\t\t{ table_definition.column_count } columns in table.")
-
-                        # Then columns
-                        for column in table_definition.columns:
+    # Reading the catalog of one file doesn't depend on any other file, so we do this on a pool of threads. We merge the results in the order of the worklist afterwards, so the output stays the same as when done one by one.
+    # Rather than opening a connection per file, the threads share a pool of connections, and each connection is reused for many files by attaching and detaching them in turn.
+    with contextlib.ExitStack() as scan_connections_stack, concurrent.futures.ThreadPoolExecutor(max_workers=preprocessing_workers) as executor:
+        scan_connections = queue.Queue()
+        for _ in range(max(1, min(preprocessing_workers, len(worklist)))):
+            scan_connections.put(scan_connections_stack.enter_context(THA.Connection(endpoint=hyper.endpoint)))
+
+        scan_futures = { hyper_file: executor.submit(scan_file, scan_connections, hyper_file) for hyper_file in worklist }
+
+        for hyper_file, scan_future in scan_futures.items():
+            try:
+                file_dict = scan_future.result()
+            except Exception as e:
+                logger.error(f"There was a problem reading data from the file { hyper_file }. The error returned was:\n\t{e}\n\t{traceback.format_exc()}")
+                exit_code = 1
+                unreadable_files.append(hyper_file)
+                continue
+
+            logger.info(f"Assimilating database/file { hyper_file }:")
+            file_tables[hyper_file] = set()
+
+            # Schemas are the top level
+            for schema in file_dict:
+                logger.info(f"\t- Schema { schema }:")
+                if schema not in output_dict:
+                    # SchemaDefinition as key, because why not
+                    output_dict[schema] = {}
+
+                # Then tables
+                for table, table_definition in file_dict[schema].items():
+                    logger.info(f"\t\t- Table { table }")
+                    if table not in output_dict[schema]:
+                        # TableDefinition as key, because why not. Its contents, columns, are at the lowest level: a dict keyed by column name, so we can look them up directly (dicts preserve insertion order, so the column order is preserved too)
+                        output_dict[schema][table] = {}
+                    logger.info(f"\t\t\t{ table_definition.column_count } columns in table.")
+                    file_tables[hyper_file].add((schema, table))
+                    input_columns_dict[(hyper_file, schema, table)] = {column.name: column for column in table_definition.columns}
+
+                    # Then columns
+                    for column in table_definition.columns:
+                        # Formatting this for every column adds up on wide tables, so only do it when it will actually be logged
+                        if logger.isEnabledFor(logging.DEBUG):
                             logger.debug(f"\t\t\t- Column {column.name} has type={column.type} and nullability={column.nullability}")
-                            # If the column doesn't exist, we simply add it
-                            if column.name not in [column.name for column in output_dict[schema][table]]:
-                                output_dict[schema][table].append(column) # Uh, okay.
+                        # If the column doesn't exist, we simply add it
+                        if column.name not in output_dict[schema][table]:
+                            output_dict[schema][table][column.name] = column
+                        else:
+                            # Two possibilities...
+                            matching_column_in_output_dict = output_dict[schema][table][column.name]
+                            if column.type != matching_column_in_output_dict.type or column.nullability != matching_column_in_output_dict.nullability or column.collation != matching_column_in_output_dict.collation:
+                                # If it does exist but doesn't match data type or nullability, we'll be in trouble. Simply discard it for now, we can think of alternative approaches later
+                                logger.warning(f"\t\t\tFound matching column { column }, but it doesn't have the same properties as the existing column. This might cause unexpected results in the output, such as missing data or a general failure. (Existing: { matching_column_in_output_dict.type }/{ matching_column_in_output_dict.nullability }/{matching_column_in_output_dict.collation}) != ({hyper_file}: { column.type }/{ column.nullability }/{column.collation})")
                             else:
-                                # Two possibilities...
-                                matching_column_in_output_dict = [column_output for column_output in output_dict[schema][table] if column_output.name == column.name][0]
-                                if column.type != matching_column_in_output_dict.type or column.nullability != matching_column_in_output_dict.nullability or column.collation != matching_column_in_output_dict.collation:
-                                    # If it does exist but doesn't match data type or nullability, we'll be in trouble. Simply discard it for now, we can think of alternative approaches later
-                                    logger.warning(f"\t\t\tFound matching column { column }, but it doesn't have the same properties as the existing column. This might cause unexpected results in the output, such as missing data or a general failure. (Existing: { matching_column_in_output_dict.type }/{ matching_column_in_output_dict.nullability }/{matching_column_in_output_dict.collation}) != ({hyper_file}: { column.type }/{ column.nullability }/{column.collation})")
-                                else:
-                                    logger.debug("Column exists in output already.")
-        except Exception as e:
-            logger.error(f"There was a problem reading data from the file { hyper_file }. The error returned was:\n\t{e}\n\t{traceback.format_exc()}")
-            input("Press Enter to continue...")
-
-        logger.info("The connection to the Hyper file has been closed.")
-    
+                                logger.debug("Column exists in output already.")
+
+    logger.info("The connections to the Hyper files have been closed.")
+
+    if len(unreadable_files) > 0:
+        logger.warning(f"Leaving { len(unreadable_files) } file(s) that could not be read out of the output: { ', '.join(unreadable_files) }")
+        worklist = [hyper_file for hyper_file in worklist if hyper_file not in unreadable_files]
+
+    # In preserve mode, if every table in the existing output file already has all the columns we're going to write, and the new files' columns fit in them (see accepts_rows()), we append the new rows to it directly (INSERT INTO ... SELECT). That saves reading all of its data and writing it out again through the temporary file.
+    append_to_output_file = False
+    preserved_file = None # The existing output file, as it appears in the worklist
+    preserved_tables = set() # (schema, table) of the existing output file that we INSERT INTO rather than CREATE
+    if args.preserve_output_file:
+        preserved_file = next((hyper_file for hyper_file in worklist if normalize_path(hyper_file) == normalize_path(args.output_file)), None)
+        if preserved_file is None and not os.path.exists(args.output_file):
+            logger.info(f"There is no output file { args.output_file } to preserve yet; creating it.")
+            output_file = args.output_file
+        elif preserved_file is not None:
+            preserved_tables = set(file_tables[preserved_file])
+            required_source_columns = { source_column_name } if source_column_name is not None else set()
+            rebuild_reason = None # Why we can't append, if we can't
+            for schema, table in preserved_tables:
+                preserved_columns = input_columns_dict[(preserved_file, schema, table)]
+                if not set(preserved_columns).issuperset(set(output_dict[schema][table]) | required_source_columns):
+                    rebuild_reason = f"table { table } is missing columns"
+                elif source_column_name is not None and preserved_columns[source_column_name].type != THA.SqlType.text():
+                    rebuild_reason = f"the { args.source_file_column_name } column of table { table } isn't TEXT"
+                else:
+                    mismatching_file = next((file for file in worklist if file != preserved_file and (schema, table) in file_tables[file] and not accepts_rows(preserved_columns, input_columns_dict[(file, schema, table)], source_column_name)), None)
+                    if mismatching_file is not None:
+                        rebuild_reason = f"the columns of table { table } in { mismatching_file } don't fit its column types or nullability"
+                if rebuild_reason is not None:
+                    break
+            if rebuild_reason is None:
+                logger.info(f"The output file { args.output_file } already has all the columns we need; appending to it directly.")
+                append_to_output_file = True
+                output_file = args.output_file
+                worklist.remove(preserved_file)
+            else:
+                logger.info(f"In the output file { args.output_file }, { rebuild_reason }; rebuilding it in a temporary file.")
+                preserved_tables = set()
+
     logger.info("Assimilated aforementioned files. Creating definitions and applying in output file.")
 
+    output_complete = True # Whether every table made it into the output; if not, we don't replace the existing output file with it
+
     try:
-        # Remove the output file in any case
-        if os.path.exists(output_file):
+        if args.preserve_output_file and preserved_file is None and os.path.exists(args.output_file):
+            # It's there and we tried to read it with the other files, but couldn't. Writing the output anyway would lose its contents.
+            raise RuntimeError("The output file to preserve could not be read (see the errors above); leaving it untouched.")
+
+        # Remove the output file, unless we're appending to it
+        if not append_to_output_file and os.path.exists(output_file):
             os.remove(output_file)
 
-        # We do not specify a database, because we'll connect to ("attach") all input files as well as the output file at once.
+        # We do not specify a database, because we'll connect to ("attach") the input files as well as the output file. The inputs are attached once all queries are built.
         with THA.Connection(endpoint=hyper.endpoint) as connection:
 
-            # Preparation of the output and the inputs
-            connection.catalog.create_database(database_path=output_file)
+            # Preparation of the output
+            if not append_to_output_file:
+                connection.catalog.create_database(database_path=output_file)
             connection.catalog.attach_database(database_path=output_file, alias="union_output")
-            for file in worklist:
-                connection.catalog.attach_database(database_path=file)
+
+            union_queries = [] # (schema, table, query), run once we've built all of them
+
+            # Escaping names is a pure function of the name, so we escape everything once rather than for every file and column we come across (the source file column's is done up top)
+            normalized_output_file = normalize_path(args.output_file)
 
             for schema in output_dict:
 
-                # Now refer to this schema as part of the output
-                output_schema = THA.SchemaName("union_output", schema)
-                connection.catalog.create_schema_if_not_exists(schema=output_schema)
+                # The schema itself is created in the output along with the tables, below
+                escaped_schema = THA.escape_name(schema.name)
 
                 for table in output_dict[schema]:
                 
-                    union_query = f"CREATE TABLE \"union_output\".{ THA.escape_name(schema.name) }.{ THA.escape_name(table.name) } AS\n"
+                    union_branches = [] # One SELECT per input file that has this table
+                    escaped_table = THA.escape_name(table.name)
+                    escaped_columns = { column_name: THA.escape_name(column_name) for column_name in output_dict[schema][table] }
+                    # The output columns are the same for every file; all that differs is whether a file has them. So we work out both ways of selecting each column once, for all files, and only pick one per file below. The source file column is added separately.
+                    column_projection = [(column_name, escaped_column, f"NULL as { escaped_column }") for column_name, escaped_column in escaped_columns.items() if source_column_name is None or column_name != source_column_name]
 
                     for file in worklist:
 
-                        file_database_name = file.split(".")[:-1][0]
-                        schema_input = THA.SchemaName(file_database_name, table.schema_name)
+                        file_alias = file_aliases[file]
 
-                        # Comparing tuples is easier as it omits the database name, TableName() doesn't.
-                        if (table.schema_name.name, table.name) in [(table_input.schema_name.name, table_input.name) for table_input in connection.catalog.get_table_names(schema=schema_input)]:
-
-                            table_input = THA.TableName(file_database_name, table.schema_name, table.name)
+                        if (schema, table) in file_tables[file]:
 
                             # We do not create the table and its definitions beforehand; it is cumbersome. Rather, we'll use CREATE ... AS with the output from the UNION query we put together
                             try:
-                                union_query += "SELECT"
-                                for column in output_dict[schema][table]:
-                                    if column.name in [column.name for column in connection.catalog.get_table_definition(name=table_input).columns] and THA.escape_name(column.name) != THA.escape_name(args.source_file_column_name):
-                                        # Source extract has this column (too)
-                                        union_query += f" { THA.escape_name(column.name) },"
-                                    elif THA.escape_name(column.name) != THA.escape_name(args.source_file_column_name):
-                                        # Source extract does not have this column
-                                        union_query += f" NULL as { THA.escape_name(column.name) },"
-                                if len(args.source_file_column_name) > 0: # If we must add the file name
-                                    if file != args.output_file:
-                                        union_query += f" '{ file }' as { args.source_file_column_name },"
+                                # Collected during pre-processing, no need to ask the catalog again
+                                input_columns = input_columns_dict[(file, schema, table)]
+                                # Either the source extract has this column (too), or it doesn't and we fill it with NULLs
+                                select_columns = [column_if_present if column_name in input_columns else column_if_missing for column_name, column_if_present, column_if_missing in column_projection]
+                                if escaped_source_column is not None: # If we must add the file name
+                                    if normalize_path(file) != normalized_output_file:
+                                        # A typed constant, so Hyper evaluates it once per branch rather than carrying an untyped literal along every row
+                                        select_columns.append(f"CAST({ THA.escape_string_literal(file) } AS TEXT) as { escaped_source_column }")
                                     else:
-                                        union_query += f" { THA.escape_name(args.source_file_column_name) } as { args.source_file_column_name },"
-                                # Pinch off the last comma we added (I know, it's dumb, but it works)
-                                union_query = union_query[:-1]
-                                union_query += f" FROM { THA.escape_name(file_database_name) }.{ THA.escape_name(schema.name) }.{ THA.escape_name(table_input.name) }\nUNION ALL\n"
+                                        select_columns.append(f"{ escaped_source_column } as { escaped_source_column }")
+                                union_branches.append(f"SELECT { ', '.join(select_columns) } FROM { THA.escape_name(file_alias) }.{ escaped_schema }.{ escaped_table }")
                             except Exception as e:
                                 logger.error(f"There was a problem building the query to read the data from table { table } in file { file }. The error returned was:\n\t{e}\n\t{traceback.format_exc()}")
-                                if union_query in locals():
-                                    logger.error(f"The query we built so far was:\n\t{ union_query }")
-                                input("Press Enter to continue...")
+                                if len(union_branches) > 0:
+                                    logger.error(f"The query we built so far was:\n\t{ union_separator.join(union_branches) }")
+                                exit_code = 1
+                                output_complete = False
                         
                         else:
                             logger.info(f"Table { table.name } is not present in file { file }; omitting it from the UNION query.")
-                    
-                    # Remove the last UNION ALL, if there is one. Super dumb, but probably the easiest way.
-                    if union_query.endswith(f"UNION ALL\n"):
-                        union_query = union_query[:-10]
 
-                    logger.debug(f"Resulting query for table { table }:\n{ union_query }")
+                    if len(union_branches) == 0:
+                        if (schema, table) in preserved_tables:
+                            logger.info(f"There is no new data for table { table }; keeping it as is.")
+                        else:
+                            logger.warning(f"None of the files could be read for table { table }; skipping it.")
+                        continue
+
+                    union_select = union_separator.join(union_branches)
+                    if (schema, table) in preserved_tables:
+                        # The table is in the output file already, with all the columns we need. Just add the new rows, in the same column order as the SELECTs.
+                        insert_columns = [escaped_column for _, escaped_column, _ in column_projection]
+                        if escaped_source_column is not None:
+                            insert_columns.append(escaped_source_column)
+                        union_query = f"INSERT INTO \"union_output\".{ escaped_schema }.{ escaped_table } ({ ', '.join(insert_columns) })\n" + union_select
+                    else:
+                        union_query = f"CREATE TABLE \"union_output\".{ escaped_schema }.{ escaped_table } AS\n" + union_select
+
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Resulting query for table { table }:\n{ union_query }")
+                    union_queries.append((schema, table, union_query))
+
+            # All writes to the output go through this one session, one query at a time. Hyper isolates sessions strictly (attaching a database while another session writes fails with "non-serializable data access"), and it already spreads each single query over all cores, so several writing sessions buy little. The parallel part is reading the files, above.
+            for file in worklist:
+                connection.catalog.attach_database(database_path=file, alias=file_aliases[file])
+
+            if append_to_output_file and not output_complete:
+                logger.error(f"Not all queries could be built, so we left { args.output_file } as it was rather than appending to only some of its tables.")
+            elif append_to_output_file:
+                # We're writing into the existing output file itself, so it's all or nothing. Otherwise a failing table would leave the others appended to, and running again would duplicate their rows.
+                # The INSERTs go in a single transaction. Hyper doesn't roll back CREATE SCHEMA or CREATE TABLE though, those take effect right away; so we create the new schemas and tables first, keep track of them and drop them again if anything fails.
+                existing_schemas = { output_schema.name for output_schema in connection.catalog.get_schema_names(database="union_output") }
+                created_schemas = []
+                created_tables = []
+                in_transaction = False
+                try:
+                    for schema in output_dict:
+                        if schema.name not in existing_schemas:
+                            connection.catalog.create_schema(schema=THA.SchemaName("union_output", schema))
+                            created_schemas.append(THA.SchemaName("union_output", schema))
+                    for schema, table, union_query in union_queries:
+                        if (schema, table) not in preserved_tables:
+                            logger.info(f"Performing UNION ALL for {schema.name}.{table.name}.")
+                            connection.execute_command(union_query)
+                            created_tables.append(THA.TableName("union_output", schema.name, table.name))
+                    connection.execute_command("BEGIN TRANSACTION")
+                    in_transaction = True
+                    for schema, table, union_query in union_queries:
+                        if (schema, table) in preserved_tables:
+                            logger.info(f"Performing UNION ALL for {schema.name}.{table.name}.")
+                            connection.execute_command(union_query)
+                    connection.execute_command("COMMIT")
+                    logger.info(f"Finished UNION ALL for all { len(union_queries) } tables.")
+                except Exception as e:
+                    if in_transaction:
+                        connection.execute_command("ROLLBACK")
+                    for created_table in reversed(created_tables):
+                        connection.execute_command(f"DROP TABLE { created_table }")
+                    for created_schema in reversed(created_schemas):
+                        connection.execute_command(f"DROP SCHEMA { created_schema }")
+                    logger.error(f"There was a problem appending to { args.output_file }, so we undid all changes to it. The error returned was:\n\t{e}\n\t{traceback.format_exc()}")
+                    exit_code = 1
+                    output_complete = False
+            else:
+                for schema in output_dict:
+                    connection.catalog.create_schema_if_not_exists(schema=THA.SchemaName("union_output", schema))
+
+                # "Process" the tables, one after the other
+                for schema, table, union_query in union_queries:
                     logger.info(f"Performing UNION ALL for {schema.name}.{table.name}.")
-                    # "Process" this table
-                    connection.execute_command(union_query)
-
-        if output_file != args.output_file:
+                    try:
+                        connection.execute_command(union_query)
+                        logger.info(f"Finished UNION ALL for {schema.name}.{table.name}.")
+                    except Exception as e:
+                        logger.error(f"There was a problem performing the UNION ALL for table { table }. The error returned was:\n\t{e}\n\t{traceback.format_exc()}")
+                        exit_code = 1
+                        output_complete = False
+
+        if output_file != args.output_file and not output_complete:
+            logger.error(f"Not all tables could be written, so we left { args.output_file } as it was. What we did manage to write is in { output_file }.")
+        elif output_file != args.output_file:
             logger.info("We wrote the output to a temporary file to also assimilate the original output file's content. Cleaning up.")
-            os.remove(args.output_file)
-            os.rename(output_file, args.output_file)
+            # In one go, so there is no moment where the original is gone but the new one isn't in place yet
+            os.replace(output_file, args.output_file)
 
     except Exception as e:
         logger.error(f"There was a problem accessing/creating/approaching the output file { args.output_file }. Perhaps the file is still open in another process, potentially Tableau? The error returned was:\n\t{e}\n\t{traceback.format_exc()}")
-        input("Press Enter to continue...")
+        exit_code = 1
 
 logger.info(f"The Hyper process has been shut down. Hypa hypaaaa!")
 
+if exit_code != 0:
+    logger.error("Some of the files or tables could not be processed; see the errors above.")
+    # Give whoever double-clicked the executable a chance to read the errors before the window closes. Only once we're done and Hyper is shut down though, and never when running on a schedule.
+    if sys.stdin is not None and sys.stdin.isatty() and not args.log_to_file:
+        input("Press Enter to continue...")
+
+sys.exit(exit_code)
+
 # Hyper Hyper: https://www.youtube.com/watch?v=7Twnmhe948A
 # But also, Hypa Hypa: https://www.youtube.com/watch?v=75Mw8r5gW8E
\ No newline at end of file